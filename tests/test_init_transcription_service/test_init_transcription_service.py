@@ -9,7 +9,9 @@ import transcribe
 @pytest.fixture(autouse=True)
 def before_each_reset_modules_and_env():
     reload(os)
-    reload(transcribe)
+    # clears registered factories without reloading transcribe,
+    # which would leave other tests holding stale copies of its classes
+    getattr(transcribe, "__TRANSCRIPTION_SERVICE_FACTORY_BY_MODULE_PATH").clear()
     if "TRANSCRIBE_MODULE_PATH" in os.environ:
         del os.environ["TRANSCRIBE_MODULE_PATH"]
     yield
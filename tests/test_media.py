@@ -0,0 +1,221 @@
+import os
+import struct
+import subprocess
+import wave
+
+import pytest
+
+from transcribe import TranscribeJobRequest, TranscribeJobStatus
+import transcribe.media
+from transcribe.media import (
+    clear_media_info_cache,
+    expected_makespan,
+    plan_transcribe_batch,
+    probe_media,
+)
+
+
+@pytest.fixture(autouse=True)
+def before_each_clear_cache():
+    clear_media_info_cache()
+    yield
+
+
+def _write_wav(path: str, secs: float, sample_rate: int = 8000) -> str:
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(b"\x00\x00" * int(secs * sample_rate))
+    return path
+
+
+def _write_mp3_cbr(path: str, n_frames: int) -> str:
+    # MPEG1 layer III, 128kbps, 44.1kHz, no padding, stereo
+    header = bytes([0xFF, 0xFB, 0x90, 0x00])
+    frame_length = 144 * 128000 // 44100
+    frame = header + b"\x00" * (frame_length - 4)
+    with open(path, "wb") as f:
+        f.write(b"ID3\x03\x00\x00\x00\x00\x00\x0a" + b"\x00" * 10)
+        f.write(frame * n_frames)
+    return path
+
+
+def _mp4_box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def _write_mp4(path: str, secs: float, timescale: int = 1000) -> str:
+    mvhd = _mp4_box(
+        b"mvhd", struct.pack(">BxxxIIII", 0, 0, 0, timescale, int(secs * timescale))
+    )
+    with open(path, "wb") as f:
+        f.write(_mp4_box(b"ftyp", b"isom\x00\x00\x02\x00"))
+        f.write(_mp4_box(b"mdat", b"\x00" * 1000))
+        f.write(_mp4_box(b"moov", mvhd))
+    return path
+
+
+def test_it_probes_wav_duration(tmpdir):
+    p = _write_wav(os.path.join(tmpdir, "a.wav"), 2.5)
+    info = probe_media(p)
+    assert info.is_valid()
+    assert info.mediaFormat == "wav"
+    assert info.durationSecs == pytest.approx(2.5)
+    assert info.sizeBytes == os.path.getsize(p)
+
+
+def test_it_probes_cbr_mp3_duration(tmpdir):
+    p = _write_mp3_cbr(os.path.join(tmpdir, "a.mp3"), 100)
+    info = probe_media(p)
+    assert info.mediaFormat == "mp3"
+    assert info.durationSecs == pytest.approx(100 * 1152 / 44100, rel=0.01)
+
+
+def test_it_probes_mp4_duration_and_ignores_misleading_extension(tmpdir):
+    p = _write_mp4(os.path.join(tmpdir, "a.wav"), 12.25)
+    info = probe_media(p)
+    assert info.mediaFormat == "mp4"
+    assert info.durationSecs == pytest.approx(12.25)
+
+
+def test_it_reports_missing_files_as_errors():
+    info = probe_media("/no/such/file.wav")
+    assert not info.is_valid()
+
+
+@pytest.mark.parametrize(
+    "name,content",
+    [("x.wav", b"this is not audio"), ("x.mp3", b"\x00" * 5000)],
+)
+def test_it_reports_garbage_with_a_parsed_extension_as_errors(
+    tmpdir, monkeypatch, name, content
+):
+    monkeypatch.setattr(transcribe.media.shutil, "which", lambda _: None)
+    p = os.path.join(tmpdir, name)
+    with open(p, "wb") as f:
+        f.write(content)
+    info = probe_media(p)
+    assert not info.is_valid()
+    plan = plan_transcribe_batch([TranscribeJobRequest(sourceFile=p, jobId="j1")])
+    assert plan.requests == []
+    assert [r.jobId for r in plan.rejected] == ["j1"]
+
+
+def test_it_reports_files_ffprobe_rejects_as_errors(tmpdir, monkeypatch):
+    def _run(cmd, **kwargs):
+        raise subprocess.CalledProcessError(1, cmd, stderr=b"Invalid data found")
+
+    monkeypatch.setattr(transcribe.media.shutil, "which", lambda _: "/bin/ffprobe")
+    monkeypatch.setattr(transcribe.media.subprocess, "run", _run)
+    p = os.path.join(tmpdir, "x.flac")
+    with open(p, "wb") as f:
+        f.write(b"not flac")
+    assert probe_media(p).error == "ffprobe failed: Invalid data found"
+
+
+def test_it_reports_files_ffprobe_sees_as_matroska_unless_named_webm(
+    tmpdir, monkeypatch
+):
+    def _run(cmd, **kwargs):
+        out = b'{"format": {"format_name": "matroska,webm", "duration": "3.5"}}'
+        return subprocess.CompletedProcess(cmd, 0, stdout=out)
+
+    monkeypatch.setattr(transcribe.media.shutil, "which", lambda _: "/bin/ffprobe")
+    monkeypatch.setattr(transcribe.media.subprocess, "run", _run)
+    mkv = os.path.join(tmpdir, "x.mkv")
+    webm = os.path.join(tmpdir, "x.webm")
+    for p in [mkv, webm]:
+        with open(p, "wb") as f:
+            f.write(b"\x1a\x45\xdf\xa3")
+    plan = plan_transcribe_batch(
+        [
+            TranscribeJobRequest(sourceFile=mkv, jobId="mkv"),
+            TranscribeJobRequest(sourceFile=webm, jobId="webm"),
+        ]
+    )
+    assert [(r.jobId, r.mediaFormat) for r in plan.requests] == [("webm", "webm")]
+    assert plan.get_error("mkv") == "unsupported media format 'matroska'"
+
+
+def test_it_schedules_unknown_durations_first_without_ffprobe(tmpdir, monkeypatch):
+    monkeypatch.setattr(transcribe.media.shutil, "which", lambda _: None)
+    short = _write_wav(os.path.join(tmpdir, "short.wav"), 1.0)
+    junk = os.path.join(tmpdir, "junk.flac")
+    with open(junk, "wb") as f:
+        f.write(b"junk" * 250)
+    long = os.path.join(tmpdir, "long.flac")
+    with open(long, "wb") as f:
+        f.write(b"fLaC" + b"\x00" * 7000000)
+    plan = plan_transcribe_batch(
+        [
+            TranscribeJobRequest(sourceFile=short, jobId="short"),
+            TranscribeJobRequest(sourceFile=junk, jobId="junk"),
+            TranscribeJobRequest(sourceFile=long, jobId="long"),
+        ]
+    )
+    assert [r.jobId for r in plan.requests] == ["long", "short"]
+    assert [r.jobId for r in plan.rejected] == ["junk"]
+    assert plan.unknownDurationJobIds == ["long"]
+    assert "needs ffprobe" in plan.mediaInfoByJobId["long"].warning
+    assert plan.expectedMakespanSecs == pytest.approx(1.0)
+
+
+def test_it_caches_results_until_the_file_changes(tmpdir):
+    p = _write_wav(os.path.join(tmpdir, "a.wav"), 1.0)
+    assert probe_media(p).durationSecs == pytest.approx(1.0)
+    st = os.stat(p)
+    _write_wav(p, 3.0)
+    os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    assert probe_media(p).durationSecs == pytest.approx(3.0)
+
+
+def test_it_bounds_the_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(transcribe.media, "MEDIA_INFO_CACHE_MAX_SIZE", 2)
+    paths = [_write_wav(os.path.join(tmpdir, f"{i}.wav"), 1.0) for i in range(3)]
+    for p in paths:
+        probe_media(p)
+    cache = getattr(transcribe.media, "__MEDIA_INFO_CACHE")
+    assert list(cache.keys()) == [os.path.abspath(p) for p in paths[1:]]
+
+
+@pytest.mark.parametrize(
+    "durations,concurrency,expected",
+    [
+        ([], 0, 0.0),
+        ([3, 1, 2], 0, 3.0),
+        ([3, 1, 2], 1, 6.0),
+        ([5, 4, 3, 3, 3], 2, 10.0),
+    ],
+)
+def test_expected_makespan(durations, concurrency, expected):
+    assert expected_makespan(durations, concurrency) == expected
+
+
+def test_it_plans_longest_jobs_first_and_rejects_unsupported(tmpdir):
+    short = _write_wav(os.path.join(tmpdir, "short.wav"), 1.0)
+    long = _write_wav(os.path.join(tmpdir, "long.wav"), 4.0)
+    video = _write_mp4(os.path.join(tmpdir, "video.mp4"), 2.0)
+    unsupported = os.path.join(tmpdir, "notes.txt")
+    with open(unsupported, "w") as f:
+        f.write("not media")
+    plan = plan_transcribe_batch(
+        [
+            TranscribeJobRequest(sourceFile=short, jobId="short"),
+            TranscribeJobRequest(sourceFile=unsupported, jobId="unsupported"),
+            TranscribeJobRequest(sourceFile=long, jobId="long"),
+            TranscribeJobRequest(sourceFile=video, jobId="video"),
+            TranscribeJobRequest(sourceFile="/no/such.wav", jobId="missing"),
+        ],
+        concurrency=2,
+    )
+    assert [r.jobId for r in plan.requests] == ["long", "video", "short"]
+    assert [r.mediaFormat for r in plan.requests] == ["wav", "mp4", "wav"]
+    assert plan.requests[0].durationSecs == pytest.approx(4.0)
+    assert [r.jobId for r in plan.rejected] == ["unsupported", "missing"]
+    assert plan.get_error("unsupported") == "unsupported media format 'txt'"
+    assert plan.totalDurationSecs == pytest.approx(7.0)
+    assert plan.expectedMakespanSecs == pytest.approx(4.0)
+    failed = plan.rejected_jobs("b1")
+    assert [j.status for j in failed] == [TranscribeJobStatus.FAILED] * 2
+    assert failed[0].error == "unsupported media format 'txt'"
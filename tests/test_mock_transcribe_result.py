@@ -5,6 +5,7 @@ from unittest.mock import patch, Mock
 
 import transcribe
 from transcribe.mock import MockTranscribeJob, MockTranscriptions
+from transcribe.tokens import TranscriptTokens
 
 
 @pytest.mark.parametrize(
@@ -46,3 +47,47 @@ def test_mocks_results_for_transcribe(
     service = transcribe.init_transcription_service()
     result = service.transcribe([x.request for x in mock_jobs])
     assert result.to_dict() == expected_result.to_dict()
+
+
+@patch.object(transcribe, "init_transcription_service")
+def test_mocks_segment_delta_updates_for_transcribe(
+    mock_init_transcription_service: Mock,
+):
+    final_segments = [
+        transcribe.TranscriptSegment("hello", 0, 1, stable=True),
+        transcribe.TranscriptSegment("world", 1, 2, stable=True),
+    ]
+    mock_job = MockTranscribeJob(
+        batch_id="b1",
+        request=transcribe.TranscribeJobRequest(jobId="j1", sourceFile="/fake/a.mp3"),
+        transcript="hello world",
+        segments=final_segments,
+        tokens=TranscriptTokens(words=["hello", "world"], starts=[0, 1], ends=[1, 2]),
+        partial_segments=[
+            [
+                transcribe.TranscriptSegment("hello", 0, 1, stable=True),
+                transcribe.TranscriptSegment("wor", 1, 1.5),
+            ],
+            [transcribe.TranscriptSegment("world", 1, 2, stable=True)],
+        ],
+    )
+    mock_transcriptions = MockTranscriptions(mock_init_transcription_service, ".")
+    mock_transcriptions.mock_transcribe_result([mock_job])
+    service = transcribe.init_transcription_service()
+    segments: List[transcribe.TranscriptSegment] = []
+
+    def _on_update(u: transcribe.TranscribeJobsUpdate) -> None:
+        nonlocal segments
+        mock_transcriptions.mock_on_update()(u)
+        segments = u.segmentDeltasById["b1-j1"].apply(segments)
+
+    result = service.transcribe([mock_job.request], on_update=_on_update)
+    mock_transcriptions.expect_on_update_called_once_per_fixture_update()
+    offsets = [
+        c.args[0].segmentDeltasById["b1-j1"].offset
+        for c in mock_transcriptions.on_update_spy.call_args_list
+    ]
+    assert offsets == [0, 1]
+    assert segments == final_segments
+    assert result.first().segments == final_segments
+    assert result.first().tokens == mock_job.tokens
@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import pytest
+
+import transcribe
+from transcribe.profile import ProfileConfig, profile_config
+
+
+@pytest.fixture(autouse=True)
+def before_each_reset_env():
+    for k in ["TRANSCRIBE_PROFILE", "TRANSCRIBE_PROFILE_CAPTURE"]:
+        if k in os.environ:
+            del os.environ[k]
+    yield
+
+
+@pytest.mark.parametrize(
+    "config,env,expected",
+    [
+        ({}, {}, ProfileConfig()),
+        ({}, {"TRANSCRIBE_PROFILE": "0"}, ProfileConfig()),
+        ({}, {"TRANSCRIBE_PROFILE": "1"}, ProfileConfig(enabled=True)),
+        (
+            {},
+            {
+                "TRANSCRIBE_PROFILE": "/tmp/profiles",
+                "TRANSCRIBE_PROFILE_CAPTURE": "cprofile, tracemalloc",
+            },
+            ProfileConfig(
+                enabled=True, reportDir="/tmp/profiles", cprofile=True, tracemalloc=True
+            ),
+        ),
+        ({}, {"TRANSCRIBE_PROFILE": "false"}, ProfileConfig()),
+        ({"profile": False}, {"TRANSCRIBE_PROFILE": "1"}, ProfileConfig()),
+        ({"profile": "false"}, {"TRANSCRIBE_PROFILE": "1"}, ProfileConfig()),
+        ({"profile": "0"}, {}, ProfileConfig()),
+        ({"profile": "true"}, {}, ProfileConfig(enabled=True)),
+        ({"profile": "/tmp/p"}, {}, ProfileConfig(enabled=True, reportDir="/tmp/p")),
+        (
+            {"profile": {"cprofile": True}},
+            {},
+            ProfileConfig(enabled=True, cprofile=True),
+        ),
+    ],
+)
+def test_it_reads_profile_config_from_config_or_env(config, env, expected):
+    os.environ.update(env)
+    assert profile_config(config) == expected
+
+
+def test_it_rejects_unknown_profile_config_keys():
+    with pytest.raises(ValueError, match="unknown key\\(s\\) \\['reportdir'\\]"):
+        profile_config({"profile": {"reportdir": "/tmp"}})
+
+
+def _init_fake_service(profile, updates=2, error=None, on_transcribe=None):
+    class _FakeService(transcribe.TranscriptionService):
+        def init_service(self, config={}, **kwargs) -> None:
+            self.config = config
+
+        def transcribe(
+            self, transcribe_requests, batch_id="", on_update=None, **kwargs
+        ):
+            if on_transcribe:
+                on_transcribe()
+            result = transcribe.transcribe_jobs_to_result(
+                transcribe.requests_to_job_batch(batch_id, transcribe_requests)
+            )
+            job_id = result.first().get_fq_id()
+            for i in range(updates):
+                result.update_job(
+                    job_id, status=transcribe.TranscribeJobStatus(3 + i % 2)
+                )
+                if on_update:
+                    on_update(transcribe.TranscribeJobsUpdate(result=result))
+            if error:
+                raise error
+            return result
+
+    transcribe.register_transcription_service_factory(
+        "tests.test_profile", _FakeService
+    )
+    return transcribe.init_transcription_service(
+        module_path="tests.test_profile", config={"profile": profile}
+    )
+
+
+def _transcribe(service, batch_id, on_update=None):
+    return service.transcribe(
+        [transcribe.TranscribeJobRequest(sourceFile="a.wav", jobId="j1")],
+        batch_id=batch_id,
+        on_update=on_update,
+    )
+
+
+def _read_report(report_dir, batch_id):
+    with open(os.path.join(report_dir, f"transcribe-profile-{batch_id}.json")) as f:
+        return json.load(f)
+
+
+def test_it_writes_a_profile_report_per_batch(tmpdir):
+    profile = {"reportDir": str(tmpdir), "cprofile": True, "tracemalloc": True}
+    service = _init_fake_service(profile)
+    assert service.config == {"profile": profile}
+    on_update_calls = []
+    result = _transcribe(service, "b1", on_update=on_update_calls.append)
+    assert result.first().status == transcribe.TranscribeJobStatus.IN_PROGRESS
+    assert len(on_update_calls) == 2
+    report = _read_report(tmpdir, "b1")
+    assert report["batchId"] == "b1"
+    assert report["timers"]["init_service"]["count"] == 1
+    assert report["timers"]["transcribe"]["count"] == 1
+    assert report["timers"]["update_job"]["count"] == 2
+    assert report["timers"]["on_update"]["count"] == 2
+    assert 0 < report["callbackTimeShare"] < 1
+    assert report["allocationPeakBytes"] > 0
+    assert transcribe._active_profiler.get() is None
+
+
+def test_it_does_not_fail_a_batch_when_the_report_cannot_be_written(tmpdir):
+    not_a_dir = os.path.join(tmpdir, "file")
+    with open(not_a_dir, "w") as f:
+        f.write("")
+    service = _init_fake_service({"reportDir": not_a_dir})
+    assert _transcribe(service, "b1").first().jobId == "j1"
+
+
+def test_it_reraises_the_backend_error_when_the_report_cannot_be_written(tmpdir):
+    not_a_dir = os.path.join(tmpdir, "file")
+    with open(not_a_dir, "w") as f:
+        f.write("")
+    service = _init_fake_service(
+        {"reportDir": not_a_dir}, error=RuntimeError("backend failed")
+    )
+    with pytest.raises(RuntimeError, match="backend failed"):
+        _transcribe(service, "b1")
+
+
+def test_it_attributes_update_job_calls_to_their_own_batch(tmpdir):
+    barrier = threading.Barrier(3)
+    service_a = _init_fake_service(
+        {"reportDir": str(tmpdir)}, updates=2, on_transcribe=barrier.wait
+    )
+    service_b = _init_fake_service(
+        {"reportDir": str(tmpdir)}, updates=5, on_transcribe=barrier.wait
+    )
+
+    def _unprofiled():
+        barrier.wait()
+        result = transcribe.transcribe_jobs_to_result(
+            [transcribe.TranscribeJobRequest(sourceFile="x", jobId="j1").to_job("c")]
+        )
+        for i in range(7):
+            result.update_job("c-j1", status=transcribe.TranscribeJobStatus(3 + i % 2))
+
+    threads = [
+        threading.Thread(target=_transcribe, args=(service_a, "a")),
+        threading.Thread(target=_transcribe, args=(service_b, "b")),
+        threading.Thread(target=_unprofiled),
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert _read_report(tmpdir, "a")["timers"]["update_job"]["count"] == 2
+    assert _read_report(tmpdir, "b")["timers"]["update_job"]["count"] == 5
+
+
+def test_it_keeps_tracemalloc_running_for_concurrent_batches(tmpdir):
+    barrier = threading.Barrier(2)
+    report_a = os.path.join(tmpdir, "transcribe-profile-a.json")
+
+    def _wait_for_report_a():
+        barrier.wait()
+        deadline = time.time() + 10
+        while not os.path.exists(report_a) and time.time() < deadline:
+            time.sleep(0.01)
+
+    profile = {"reportDir": str(tmpdir), "tracemalloc": True}
+    service_a = _init_fake_service(profile, on_transcribe=barrier.wait)
+    service_b = _init_fake_service(profile, on_transcribe=_wait_for_report_a)
+    threads = [
+        threading.Thread(target=_transcribe, args=(service_a, "a")),
+        threading.Thread(target=_transcribe, args=(service_b, "b")),
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for batch_id in ["a", "b"]:
+        report = _read_report(tmpdir, batch_id)
+        assert report["allocationPeakBytes"] > 0
+        assert report["allocationSites"]
+    assert not tracemalloc.is_tracing()
@@ -1,4 +1,14 @@
-from transcribe import TranscribeBatchResult, TranscribeJobRequest
+import pytest
+
+from transcribe import (
+    copy_shallow,
+    TranscribeBatchResult,
+    TranscribeJobRequest,
+    TranscribeJobStatus,
+    TranscribeJobsUpdate,
+    TranscriptSegment,
+    TranscriptSegmentsDelta,
+)
 
 
 def test_it_returns_jobs():
@@ -22,3 +32,111 @@ def test_it_first_job_as_a_convenience_for_single_job_requests():
         )
     )
     assert batch_result.first().get_fq_id() == "b1-job1"
+
+
+def test_it_appends_segments_and_replaces_only_the_unstable_tail():
+    batch_result = TranscribeBatchResult(
+        transcribeJobsById=dict(
+            job1=TranscribeJobRequest(sourceFile="x", jobId="job1").to_job("b1")
+        )
+    )
+    d1 = batch_result.append_segments(
+        "job1",
+        [
+            TranscriptSegment("hello", 0.0, 0.5, stable=True),
+            TranscriptSegment("wor", 0.5, 0.8),
+        ],
+    )
+    assert d1.offset == 0
+    snapshot = copy_shallow(batch_result)
+    d2 = batch_result.append_segments(
+        "job1",
+        [
+            TranscriptSegment("world", 0.5, 1.0, stable=True),
+            TranscriptSegment("agai", 1.0, 1.2),
+        ],
+    )
+    assert d2.offset == 1
+    assert batch_result.first().partial_transcript() == "hello world agai"
+    assert snapshot.first().partial_transcript() == "hello wor"
+    consumer_segments = d2.apply(d1.apply([]))
+    assert consumer_segments == batch_result.first().segments
+
+
+def test_it_round_trips_segment_deltas_in_updates():
+    batch_result = TranscribeBatchResult(
+        transcribeJobsById=dict(
+            job1=TranscribeJobRequest(sourceFile="x", jobId="job1").to_job("b1")
+        )
+    )
+    delta = batch_result.append_segments("job1", [TranscriptSegment("hi", 0, 0.2)])
+    update = TranscribeJobsUpdate(
+        result=batch_result, idsUpdated=["job1"], segmentDeltasById={"job1": delta}
+    )
+    assert TranscribeJobsUpdate(**update.to_dict()).to_dict() == update.to_dict()
+
+
+def test_it_sends_only_segment_deltas_for_unresolved_jobs_in_updates():
+    batch_result = TranscribeBatchResult(
+        transcribeJobsById=dict(
+            job1=TranscribeJobRequest(sourceFile="x", jobId="job1").to_job("b1")
+        )
+    )
+    batch_result.update_job("job1", status=TranscribeJobStatus.IN_PROGRESS)
+    batch_result.append_segments("job1", [TranscriptSegment("a", 0, 1, stable=True)])
+    delta = batch_result.append_segments("job1", [TranscriptSegment("b", 1, 2)])
+    d = TranscribeJobsUpdate(
+        result=batch_result, idsUpdated=["job1"], segmentDeltasById={"job1": delta}
+    ).to_dict()
+    assert d["result"]["transcribeJobsById"]["job1"]["segments"] == []
+    assert d["segmentDeltasById"]["job1"] == {
+        "offset": 1,
+        "segments": [TranscriptSegment("b", 1, 2).to_dict()],
+    }
+    assert len(batch_result.to_dict()["transcribeJobsById"]["job1"]["segments"]) == 2
+    batch_result.update_job("job1", status=TranscribeJobStatus.SUCCEEDED)
+    d = TranscribeJobsUpdate(result=batch_result, idsUpdated=["job1"]).to_dict()
+    assert len(d["result"]["transcribeJobsById"]["job1"]["segments"]) == 2
+
+
+def test_it_rejects_segments_for_resolved_jobs():
+    batch_result = TranscribeBatchResult(
+        transcribeJobsById=dict(
+            job1=TranscribeJobRequest(sourceFile="x", jobId="job1").to_job("b1")
+        )
+    )
+    batch_result.update_job("job1", status=TranscribeJobStatus.FAILED)
+    with pytest.raises(Exception, match="already FAILED"):
+        batch_result.append_segments("job1", [TranscriptSegment("late", 0, 1)])
+
+
+def test_it_rejects_segment_deltas_past_the_end():
+    delta = TranscriptSegmentsDelta(offset=2, segments=[TranscriptSegment("c")])
+    with pytest.raises(ValueError, match="past the end"):
+        delta.apply([TranscriptSegment("a")])
+    with pytest.raises(ValueError, match="past the end"):
+        TranscriptSegmentsDelta(offset=0, segments=[TranscriptSegment("a")]).merge(
+            delta
+        )
+
+
+def test_it_merges_segment_deltas_appended_between_two_updates():
+    batch_result = TranscribeBatchResult(
+        transcribeJobsById=dict(
+            job1=TranscribeJobRequest(sourceFile="x", jobId="job1").to_job("b1")
+        )
+    )
+    batch_result.append_segments("job1", [TranscriptSegment("a", 0, 1, stable=True)])
+    consumer_segments = list(batch_result.first().segments)
+    pending = batch_result.append_segments(
+        "job1",
+        [TranscriptSegment("b", 1, 2, stable=True), TranscriptSegment("c", 2, 3)],
+    )
+    pending = pending.merge(
+        batch_result.append_segments("job1", [TranscriptSegment("cd", 2, 3)])
+    )
+    assert pending.offset == 1
+    assert pending.apply(consumer_segments) == batch_result.first().segments
+    assert batch_result.first().partial_transcript() == "a b cd"
+    rewind = TranscriptSegmentsDelta(offset=0, segments=[TranscriptSegment("x")])
+    assert pending.merge(rewind).apply(consumer_segments) == [TranscriptSegment("x")]
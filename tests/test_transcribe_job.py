@@ -7,3 +7,12 @@ def test_it_uses_batch_id_in_fully_qualified_name():
     job = job_req.to_job(batch_id="mybatch8")
     assert job.batchId == "mybatch8"
     assert job.get_fq_id() == "mybatch8-j1"
+
+
+def test_it_carries_probed_duration_and_size_to_the_job():
+    job_req = TranscribeJobRequest(
+        sourceFile="/path/to/a.wav", jobId="j1", durationSecs=12.5, sizeBytes=1024
+    )
+    job = job_req.to_job(batch_id="b1")
+    assert job.durationSecs == 12.5
+    assert job.sizeBytes == 1024
@@ -0,0 +1,116 @@
+from transcribe import (
+    TranscribeJob,
+    TranscribeJobRequest,
+    TranscribeJobStatus,
+    transcribe_jobs_to_result,
+    TranscriptSegment,
+    TranscriptSegmentsDelta,
+)
+from transcribe.tokens import TranscriptToken, TranscriptTokens
+
+
+def _tokens() -> TranscriptTokens:
+    tokens = TranscriptTokens()
+    tokens.append("hello", 0.0, 0.5, 0.99, speaker="spk_0")
+    tokens.append("there", 0.5, 0.9, 0.4, speaker="spk_0")
+    tokens.append("général", 1.2, 1.8, 0.9, speaker="spk_1")
+    tokens.append("kenobi", 1.8, 2.5, 0.3)
+    return tokens
+
+
+def test_it_stores_tokens_as_columns_and_reads_rows():
+    tokens = _tokens()
+    assert len(tokens) == 4
+    assert tokens.speakers == ["spk_0", "spk_1"]
+    assert tokens.speakerIndexes.tolist() == [0, 0, 1, -1]
+    assert tokens[2] == TranscriptToken(
+        word="général",
+        startSecs=1.2,
+        endSecs=1.8,
+        confidence=tokens[2].confidence,
+        speaker="spk_1",
+    )
+    assert tokens.text() == "hello there général kenobi"
+
+
+def test_it_slices_tokens_by_time_range():
+    tokens = _tokens()
+    assert tokens.slice_time(0.6, 1.3).words == ["there", "général"]
+    assert tokens.slice_time(0.9, 1.2).words == []
+    assert tokens.slice_time(0.0, 10.0).words == tokens.words
+
+
+def test_it_filters_low_confidence_tokens():
+    low = _tokens().low_confidence(0.5)
+    assert low.words == ["there", "kenobi"]
+    assert [t.speaker for t in low] == ["spk_0", ""]
+
+
+def test_it_round_trips_through_dict_and_bytes():
+    tokens = _tokens()
+    assert TranscriptTokens(**tokens.to_dict()) == tokens
+    assert TranscriptTokens.from_bytes(tokens.to_bytes()) == tokens
+    assert (
+        TranscriptTokens.from_bytes(TranscriptTokens().to_bytes()) == TranscriptTokens()
+    )
+
+
+def test_it_carries_tokens_on_jobs():
+    job = TranscribeJobRequest(sourceFile="a.wav", jobId="j1").to_job("b1")
+    job.tokens = _tokens()
+    d = job.to_dict()
+    assert d["tokens"]["words"][0] == "hello"
+    assert TranscribeJob(**d).tokens == job.tokens
+    job.tokens = None
+    assert job.to_dict()["tokens"] is None
+
+
+def test_it_round_trips_an_empty_token_table_on_jobs():
+    job = TranscribeJobRequest(sourceFile="a.wav", jobId="j1").to_job("b1")
+    job.tokens = TranscriptTokens()
+    d = job.to_dict()
+    assert d["tokens"] == TranscriptTokens().to_dict()
+    assert TranscribeJob(**d).tokens == TranscriptTokens()
+
+
+def test_it_updates_jobs_without_copying_the_token_table():
+    result = transcribe_jobs_to_result(
+        [TranscribeJobRequest(sourceFile="a.wav", jobId="j1").to_job("b1")]
+    )
+    tokens = _tokens()
+    result.update_job("b1-j1", status=TranscribeJobStatus.SUCCEEDED, tokens=tokens)
+    assert result.first().tokens is tokens
+
+
+def test_it_keeps_tokens_on_updates_that_pass_no_tokens():
+    result = transcribe_jobs_to_result(
+        [TranscribeJobRequest(sourceFile="a.wav", jobId="j1").to_job("b1")]
+    )
+    tokens = _tokens()
+    result.update_job("b1-j1", status=TranscribeJobStatus.IN_PROGRESS, tokens=tokens)
+    result.update_job("b1-j1", status=TranscribeJobStatus.SUCCEEDED)
+    assert result.first().tokens is tokens
+
+
+def test_it_keeps_confidences_exact_in_json():
+    assert _tokens().to_dict()["confidences"] == [0.99, 0.4, 0.9, 0.3]
+
+
+def test_it_slices_tokens_that_are_not_in_time_order():
+    tokens = TranscriptTokens()
+    tokens.append("so", 0.0, 3.0, speaker="spk_0")
+    tokens.append("yes", 1.0, 1.2, speaker="spk_1")
+    tokens.append("anyway", 3.0, 3.5, speaker="spk_0")
+    assert tokens.slice_time(1.5, 3.2).words == ["so", "anyway"]
+    assert tokens.slice_time(1.1, 1.5).words == ["so", "yes"]
+    overlapping = TranscriptTokens(**tokens.to_dict())
+    assert overlapping.slice_time(1.5, 3.2).words == ["so", "anyway"]
+
+
+def test_segment_deltas_round_trip_without_tokens():
+    delta = TranscriptSegmentsDelta(offset=1, segments=[TranscriptSegment("hi", 0, 1)])
+    assert delta.to_dict() == {
+        "offset": 1,
+        "segments": [{"text": "hi", "startSecs": 0, "endSecs": 1, "stable": False}],
+    }
+    assert TranscriptSegmentsDelta(**delta.to_dict()).to_dict() == delta.to_dict()
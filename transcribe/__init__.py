@@ -5,13 +5,17 @@
 # The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
 #
 from abc import ABC, abstractmethod
-from dataclasses import asdict, dataclass, field
+from contextlib import nullcontext
+from contextvars import ContextVar, Token
+from dataclasses import asdict, dataclass, field, replace
 import enum
 from importlib import import_module
 import os
-from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+from typing import Any, Callable, ContextManager, Dict, Iterable, List, Optional, Union
 import uuid
 
+from transcribe.tokens import TranscriptToken, TranscriptTokens  # noqa: F401
+
 # if in a dev/pytest-enabled env...
 try:
     import pytest
@@ -33,6 +37,31 @@ def next_job_id() -> str:
     return str(uuid.uuid4())
 
 
+class ProfileTimer(ABC):
+    @abstractmethod
+    def timer(self, name: str) -> ContextManager[None]:
+        raise NotImplementedError()
+
+
+# set only within the context of a batch being profiled (see transcribe.profile)
+_active_profiler: "ContextVar[Optional[ProfileTimer]]" = ContextVar(
+    "transcribe_active_profiler", default=None
+)
+
+
+def set_active_profiler(profiler: Optional[ProfileTimer]) -> Token:
+    return _active_profiler.set(profiler)
+
+
+def reset_active_profiler(token: Token) -> None:
+    _active_profiler.reset(token)
+
+
+def profile_timer(name: str) -> ContextManager[None]:
+    profiler = _active_profiler.get()
+    return profiler.timer(name) if profiler else nullcontext()
+
+
 class TranscribeJobStatus(enum.Enum):
     NONE = 0
     UPLOADING = 1
@@ -43,6 +72,67 @@ class TranscribeJobStatus(enum.Enum):
     FAILED = 6
 
 
+@dataclass
+class TranscriptSegment:
+    text: str
+    startSecs: float = 0.0
+    endSecs: float = 0.0
+    stable: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class TranscriptSegmentsDelta:
+    """
+    Replaces a job's segments from `offset` on with `segments`.
+    Stable segments are never replaced, so `offset` is always
+    at or after the last stable segment the consumer has seen
+    and the delta is append-only for everything that was stable.
+    """
+
+    offset: int = 0
+    segments: List[TranscriptSegment] = field(default_factory=lambda: [])
+
+    def __post_init__(self):
+        self.segments = [
+            TranscriptSegment(**s) if isinstance(s, dict) else s for s in self.segments
+        ]
+
+    def apply(self, segments: List[TranscriptSegment]) -> List[TranscriptSegment]:
+        if self.offset > len(segments):
+            raise ValueError(
+                f"segments delta offset {self.offset} is past the end of {len(segments)} segments"
+            )
+        return segments[: self.offset] + self.segments
+
+    def merge(self, next: "TranscriptSegmentsDelta") -> "TranscriptSegmentsDelta":
+        """
+        Combines this delta with the one that followed it,
+        e.g. when a backend appends segments more than once
+        between two updates but sends a single delta per job.
+        """
+        if next.offset > self.offset + len(self.segments):
+            raise ValueError(
+                f"segments delta offset {next.offset} is past the end of the previous delta ({self.offset} + {len(self.segments)} segments)"
+            )
+        if next.offset <= self.offset:
+            return TranscriptSegmentsDelta(
+                offset=next.offset, segments=list(next.segments)
+            )
+        return TranscriptSegmentsDelta(
+            offset=self.offset,
+            segments=self.segments[: next.offset - self.offset] + next.segments,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "offset": self.offset,
+            "segments": [s.to_dict() for s in self.segments],
+        }
+
+
 @dataclass
 class TranscribeJob:
     batchId: str
@@ -54,11 +144,20 @@ class TranscribeJob:
     transcript: str = ""
     error: str = ""
     info: Dict[str, str] = field(default_factory=lambda: {})
+    durationSecs: float = 0.0
+    sizeBytes: int = 0
+    segments: List[TranscriptSegment] = field(default_factory=lambda: [])
+    tokens: Optional[TranscriptTokens] = None
 
     def __post_init__(self):
         self.transcript = self.transcript or ""
         if isinstance(self.status, str):
             self.status = TranscribeJobStatus[str(self.status)]
+        self.segments = [
+            TranscriptSegment(**s) if isinstance(s, dict) else s for s in self.segments
+        ]
+        if isinstance(self.tokens, dict):
+            self.tokens = TranscriptTokens(**self.tokens)
 
     def get_fq_id(self) -> str:
         return f"{self.batchId}-{self.jobId}"
@@ -68,8 +167,17 @@ class TranscribeJob:
             self.status in [TranscribeJobStatus.SUCCEEDED, TranscribeJobStatus.FAILED]
         )
 
-    def to_dict(self) -> Dict[str, Any]:
-        return asdict(self)
+    def partial_transcript(self) -> str:
+        return " ".join(s.text for s in self.segments if s.text)
+
+    def to_dict(self, include_segments: bool = True) -> Dict[str, Any]:
+        result = asdict(
+            replace(self, tokens=None, segments=[])
+            if not include_segments
+            else replace(self, tokens=None)
+        )
+        result["tokens"] = self.tokens.to_dict() if self.tokens is not None else None
+        return result
 
 
 @dataclass
@@ -78,6 +186,8 @@ class TranscribeJobRequest:
     jobId: str = ""
     mediaFormat: str = ""
     languageCode: str = "en-US"
+    durationSecs: float = 0.0
+    sizeBytes: int = 0
 
     def __post_init__(self):
         self.jobId = self.jobId or next_job_id()
@@ -101,6 +211,8 @@ class TranscribeJobRequest:
             languageCode=self.get_language_code(),
             sourceFile=self.sourceFile,
             mediaFormat=self.get_media_format(),
+            durationSecs=self.durationSecs,
+            sizeBytes=self.sizeBytes,
         )
 
 
@@ -189,22 +301,56 @@ class TranscribeBatchResult:
         info: Dict[str, str] = {},
         transcript: str = "",
         error: str = "",
+        tokens: Optional[TranscriptTokens] = None,
     ) -> bool:
-        if id not in self.transcribeJobsById:
-            raise Exception(
-                f"update for untracked transcribe job id '{id}' (known ids={sorted(self.transcribeJobsById.keys())})"
+        with profile_timer("update_job"):
+            if id not in self.transcribeJobsById:
+                raise Exception(
+                    f"update for untracked transcribe job id '{id}' (known ids={sorted(self.transcribeJobsById.keys())})"
+                )
+            job_cur = self.transcribeJobsById.get(id)
+            assert job_cur is not None
+            if job_cur.status == status:
+                return False
+            self.transcribeJobsById[id] = replace(
+                job_cur,
+                status=status or TranscribeJobStatus.NONE,
+                transcript=transcript or "",
+                error=error or "",
+                info=info or {},
+                tokens=tokens if tokens is not None else job_cur.tokens,
             )
+            return True
+
+    def append_segments(
+        self, id: str, segments: Iterable[TranscriptSegment]
+    ) -> TranscriptSegmentsDelta:
+        """
+        Adds partial transcript segments to an (usually IN_PROGRESS) job.
+        Any unstable segments at the end of the job are replaced,
+        since a backend resends them until they become stable.
+        The job is replaced rather than mutated, so results
+        already passed to on_update don't change.
+        When segments are appended more than once before the next update,
+        send the deltas combined with `TranscriptSegmentsDelta.merge`.
+        """
         job_cur = self.transcribeJobsById.get(id)
-        assert job_cur is not None
-        if job_cur.status == status:
-            return False
-        job_updated = TranscribeJob(**job_cur.to_dict())
-        job_updated.status = status or TranscribeJobStatus.NONE
-        job_updated.transcript = transcript or ""
-        job_updated.error = error or ""
-        job_updated.info = info or {}
-        self.transcribeJobsById[id] = job_updated
-        return True
+        if job_cur is None:
+            raise Exception(
+                f"segments for untracked transcribe job id '{id}' (known ids={sorted(self.transcribeJobsById.keys())})"
+            )
+        if job_cur.is_resolved():
+            raise Exception(
+                f"segments for transcribe job id '{id}' which is already {job_cur.status.name}"
+            )
+        offset = len(job_cur.segments)
+        while offset > 0 and not job_cur.segments[offset - 1].stable:
+            offset -= 1
+        delta = TranscriptSegmentsDelta(offset=offset, segments=list(segments))
+        self.transcribeJobsById[id] = replace(
+            job_cur, segments=delta.apply(job_cur.segments)
+        )
+        return delta
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -220,18 +366,38 @@ class TranscribeJobsUpdate:
         default_factory=lambda: TranscribeBatchResult()
     )
     idsUpdated: List[str] = field(default_factory=lambda: [])
+    segmentDeltasById: Dict[str, TranscriptSegmentsDelta] = field(
+        default_factory=lambda: {}
+    )
 
     def __post_init__(self):
         if isinstance(self.result, dict):
             self.result = TranscribeBatchResult(**self.result)
+        self.segmentDeltasById = {
+            k: TranscriptSegmentsDelta(**v) if isinstance(v, dict) else v
+            for (k, v) in self.segmentDeltasById.items()
+        }
 
     def jobs_updated(self) -> Iterable[TranscribeJob]:
         return self.result.jobs(ids=self.idsUpdated)
 
     def to_dict(self) -> Dict[str, Any]:
+        """
+        Jobs that aren't resolved yet are serialized without their segments:
+        consumers rebuild those from `segmentDeltasById`,
+        so an update's size doesn't grow with the partial transcript
+        """
         return {
-            "result": self.result.to_dict(),
+            "result": {
+                "transcribeJobsById": {
+                    k: v.to_dict(include_segments=v.is_resolved())
+                    for k, v in self.result.transcribeJobsById.items()
+                }
+            },
             "idsUpdated": [i for i in self.idsUpdated],
+            "segmentDeltasById": {
+                k: v.to_dict() for k, v in self.segmentDeltasById.items()
+            },
         }
 
 
@@ -303,5 +469,10 @@ def init_transcription_service(
     fac = __TRANSCRIPTION_SERVICE_FACTORY_BY_MODULE_PATH[effective_module_path]
     service = fac()
     assert isinstance(service, TranscriptionService)
+    from transcribe.profile import profile_config, ProfiledTranscriptionService
+
+    profile = profile_config(config)
+    if profile.enabled:
+        service = ProfiledTranscriptionService(service, profile)
     service.init_service(config=config)
     return service
@@ -0,0 +1,492 @@
+#
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+import heapq
+import json
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import threading
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from transcribe import (
+    TranscribeJob,
+    TranscribeJobRequest,
+    TranscribeJobStatus,
+)
+
+SUPPORTED_MEDIA_FORMATS = frozenset(["amr", "flac", "mp3", "mp4", "ogg", "wav", "webm"])
+
+_MP3_KBPS_MPEG1 = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+_MP3_KBPS_MPEG2 = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+_MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG 1
+    2: [22050, 24000, 16000],  # MPEG 2
+    0: [11025, 12000, 8000],  # MPEG 2.5
+}
+_MP3_SYNC_SEARCH_BYTES = 64 * 1024
+# formats we don't parse ourselves, but can at least recognize by magic bytes
+_MAGIC_BY_FORMAT = {
+    "amr": b"#!AMR",
+    "flac": b"fLaC",
+    "ogg": b"OggS",
+    "webm": b"\x1a\x45\xdf\xa3",
+}
+_FFPROBE_FORMATS = [
+    ("mp4", "mp4"),
+    ("mov", "mp4"),
+    ("wav", "wav"),
+    ("mp3", "mp3"),
+    ("flac", "flac"),
+    ("ogg", "ogg"),
+    ("amr", "amr"),
+]
+
+
+@dataclass
+class MediaInfo:
+    sourceFile: str
+    mediaFormat: str = ""
+    durationSecs: float = 0.0
+    sizeBytes: int = 0
+    error: str = ""
+    warning: str = ""
+
+    def is_valid(self) -> bool:
+        return not self.error
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class MediaProbeError(Exception):
+    pass
+
+
+def _read_exact(f: BinaryIO, n: int) -> bytes:
+    b = f.read(n)
+    if len(b) != n:
+        raise MediaProbeError("unexpected end of file")
+    return b
+
+
+def _probe_wav_duration(f: BinaryIO, size: int) -> float:
+    f.seek(12)
+    byte_rate = 0
+    while f.tell() + 8 <= size:
+        chunk_id, chunk_size = struct.unpack("<4sI", _read_exact(f, 8))
+        if chunk_id == b"fmt ":
+            _, _, _, byte_rate = struct.unpack("<HHII", _read_exact(f, 12))
+            f.seek(chunk_size - 12 + (chunk_size & 1), os.SEEK_CUR)
+        elif chunk_id == b"data":
+            if not byte_rate:
+                raise MediaProbeError("wav data chunk precedes fmt chunk")
+            data_size = min(chunk_size, size - f.tell())
+            return data_size / byte_rate
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    raise MediaProbeError("wav has no data chunk")
+
+
+def _mp4_boxes(f: BinaryIO, start: int, end: int) -> Iterable[Tuple[bytes, int, int]]:
+    """
+    Yields (type, payload_start, box_end) for each ISO-BMFF box in [start, end)
+    without reading payloads, so large mdat boxes cost a single seek.
+    """
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        box_size, box_type = struct.unpack(">I4s", _read_exact(f, 8))
+        header_size = 8
+        if box_size == 1:
+            (box_size,) = struct.unpack(">Q", _read_exact(f, 8))
+            header_size = 16
+        elif box_size == 0:
+            box_size = end - pos
+        if box_size < header_size:
+            raise MediaProbeError(f"mp4 box '{box_type!r}' has invalid size")
+        yield box_type, pos + header_size, min(pos + box_size, end)
+        pos += box_size
+
+
+def _probe_mp4_duration(f: BinaryIO, size: int) -> float:
+    for box_type, payload_start, box_end in _mp4_boxes(f, 0, size):
+        if box_type != b"moov":
+            continue
+        for child_type, child_start, _ in _mp4_boxes(f, payload_start, box_end):
+            if child_type != b"mvhd":
+                continue
+            f.seek(child_start)
+            version = _read_exact(f, 4)[0]
+            if version == 1:
+                _, _, timescale, duration = struct.unpack(">QQIQ", _read_exact(f, 28))
+            else:
+                _, _, timescale, duration = struct.unpack(">IIII", _read_exact(f, 16))
+            if not timescale:
+                raise MediaProbeError("mp4 mvhd has zero timescale")
+            return duration / timescale
+    raise MediaProbeError("mp4 has no moov/mvhd box")
+
+
+def _parse_mp3_frame_header(b: bytes) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Returns (bitrate_bps, sample_rate, samples_per_frame, frame_length)
+    for a valid MPEG layer III frame header, otherwise None
+    """
+    if len(b) < 4 or b[0] != 0xFF or (b[1] & 0xE0) != 0xE0:
+        return None
+    version = (b[1] >> 3) & 0x03
+    layer = (b[1] >> 1) & 0x03
+    bitrate_index = b[2] >> 4
+    sample_rate_index = (b[2] >> 2) & 0x03
+    if version == 1 or layer != 1 or sample_rate_index == 3:
+        return None
+    if bitrate_index == 0 or bitrate_index == 15:
+        return None
+    padding = (b[2] >> 1) & 0x01
+    bitrates = _MP3_KBPS_MPEG1 if version == 3 else _MP3_KBPS_MPEG2
+    bitrate = bitrates[bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+    samples_per_frame = 1152 if version == 3 else 576
+    frame_length = (samples_per_frame // 8) * bitrate // sample_rate + padding
+    return bitrate, sample_rate, samples_per_frame, frame_length
+
+
+def _id3v2_size(head: bytes) -> int:
+    if len(head) < 10 or head[:3] != b"ID3":
+        return 0
+    n = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+    return 10 + n + (10 if head[5] & 0x10 else 0)
+
+
+def _probe_mp3_duration(f: BinaryIO, size: int) -> float:
+    f.seek(0)
+    audio_start = _id3v2_size(f.read(10))
+    f.seek(audio_start)
+    buf = f.read(_MP3_SYNC_SEARCH_BYTES)
+    for i in range(len(buf) - 3):
+        header = _parse_mp3_frame_header(buf[i : i + 4])
+        if not header:
+            continue
+        bitrate, sample_rate, samples_per_frame, frame_length = header
+        next_frame = buf[i + frame_length : i + frame_length + 4]
+        if len(next_frame) == 4 and not _parse_mp3_frame_header(next_frame):
+            continue  # false sync inside some other data
+        mono = (buf[i + 3] >> 6) == 3
+        if samples_per_frame == 1152:
+            side_info = 17 if mono else 32
+        else:
+            side_info = 9 if mono else 17
+        xing = i + 4 + side_info
+        if buf[xing : xing + 4] in (b"Xing", b"Info"):
+            (flags,) = struct.unpack(">I", buf[xing + 4 : xing + 8])
+            if flags & 0x01:
+                (frames,) = struct.unpack(">I", buf[xing + 8 : xing + 12])
+                return frames * samples_per_frame / sample_rate
+        vbri = i + 4 + 32
+        if buf[vbri : vbri + 4] == b"VBRI":
+            (frames,) = struct.unpack(">I", buf[vbri + 14 : vbri + 18])
+            return frames * samples_per_frame / sample_rate
+        return (size - audio_start - i) * 8 / bitrate
+    raise MediaProbeError("no mp3 frame sync found")
+
+
+def _sniff_media_format(head: bytes) -> str:
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[4:8] == b"ftyp":
+        return "mp4"
+    if head[:3] == b"ID3" or _parse_mp3_frame_header(head[:4]):
+        return "mp3"
+    return ""
+
+
+_PROBE_DURATION_BY_FORMAT = {
+    "mp3": _probe_mp3_duration,
+    "mp4": _probe_mp4_duration,
+    "wav": _probe_wav_duration,
+}
+
+
+def _ffprobe(source_file: str, size: int, ext_format: str) -> Optional[MediaInfo]:
+    """
+    Returns None if ffprobe isn't installed
+    and raises MediaProbeError if ffprobe can't read the file
+    """
+    ffprobe = shutil.which("ffprobe")
+    if not ffprobe:
+        return None
+    try:
+        out = subprocess.run(
+            [
+                ffprobe,
+                "-v",
+                "error",
+                "-show_entries",
+                "format=format_name,duration",
+                "-of",
+                "json",
+                source_file,
+            ],
+            capture_output=True,
+            check=True,
+            timeout=30,
+        ).stdout
+    except OSError:
+        return None
+    except subprocess.CalledProcessError as err:
+        stderr = err.stderr.decode("utf-8", errors="replace").strip()
+        raise MediaProbeError(f"ffprobe failed: {stderr}")
+    except subprocess.SubprocessError as err:
+        raise MediaProbeError(f"ffprobe failed: {err}")
+    try:
+        fmt = json.loads(out).get("format", {})
+    except ValueError as err:
+        raise MediaProbeError(f"ffprobe returned invalid json: {err}")
+    format_names = str(fmt.get("format_name", "")).split(",")
+    if "matroska" in format_names:
+        # ffprobe reports "matroska,webm" for both .mkv and .webm
+        media_format = "webm" if ext_format == "webm" else "matroska"
+    else:
+        media_format = next(
+            (f for n, f in _FFPROBE_FORMATS if n in format_names), format_names[0]
+        )
+    try:
+        duration = float(fmt.get("duration", 0) or 0)
+    except ValueError:
+        duration = 0.0
+    return MediaInfo(
+        sourceFile=source_file,
+        mediaFormat=media_format,
+        durationSecs=duration,
+        sizeBytes=size,
+        warning="" if duration > 0 else "duration unknown: ffprobe reported none",
+    )
+
+
+def _probe_media_uncached(source_file: str, size: int) -> MediaInfo:
+    ext_format = os.path.splitext(source_file)[1][1:].lower()
+    with open(source_file, "rb") as f:
+        head = f.read(12)
+        media_format = _sniff_media_format(head)
+        if media_format:
+            try:
+                duration = _PROBE_DURATION_BY_FORMAT[media_format](f, size)
+                return MediaInfo(
+                    sourceFile=source_file,
+                    mediaFormat=media_format,
+                    durationSecs=duration,
+                    sizeBytes=size,
+                )
+            except (MediaProbeError, struct.error) as err:
+                probe_error = f"failed to parse {media_format} headers: {err}"
+        elif ext_format in _PROBE_DURATION_BY_FORMAT or (
+            ext_format in _MAGIC_BY_FORMAT
+            and not head.startswith(_MAGIC_BY_FORMAT[ext_format])
+        ):
+            probe_error = f"file does not have valid {ext_format} headers"
+        else:
+            probe_error = ""
+    try:
+        result = _ffprobe(source_file, size, ext_format)
+    except MediaProbeError as err:
+        result = None
+        probe_error = str(err)
+    if result:
+        return result
+    return MediaInfo(
+        sourceFile=source_file,
+        mediaFormat=media_format or ext_format,
+        sizeBytes=size,
+        error=probe_error,
+        warning=(
+            ""
+            if probe_error
+            else f"duration unknown: {ext_format or 'this format'} needs ffprobe, which is not installed"
+        ),
+    )
+
+
+MEDIA_INFO_CACHE_MAX_SIZE = 4096
+# abspath => (size, mtime, info), least recently used first
+__MEDIA_INFO_CACHE: "OrderedDict[str, Tuple[int, int, MediaInfo]]" = OrderedDict()
+__MEDIA_INFO_CACHE_LOCK = threading.Lock()
+
+
+def clear_media_info_cache() -> None:
+    global __MEDIA_INFO_CACHE
+    with __MEDIA_INFO_CACHE_LOCK:
+        __MEDIA_INFO_CACHE.clear()
+
+
+def probe_media(source_file: str) -> MediaInfo:
+    """
+    Reads the format, duration and size of a local media file
+    from its container headers.
+
+    WAV, MP3 and MP4 are parsed directly; anything else falls back
+    to ffprobe if it's on the PATH. Results are cached per path (LRU, up to
+    MEDIA_INFO_CACHE_MAX_SIZE files) and invalidated when size or mtime
+    change, so re-probing an unchanged file is just a stat call.
+    Failures are returned in `MediaInfo.error` rather than raised.
+    """
+    global __MEDIA_INFO_CACHE
+    try:
+        st = os.stat(source_file)
+    except OSError as err:
+        return MediaInfo(sourceFile=source_file, error=str(err))
+    key = os.path.abspath(source_file)
+    with __MEDIA_INFO_CACHE_LOCK:
+        cached = __MEDIA_INFO_CACHE.get(key)
+        if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+            __MEDIA_INFO_CACHE.move_to_end(key)
+            return replace(cached[2], sourceFile=source_file)
+    try:
+        result = _probe_media_uncached(source_file, st.st_size)
+    except OSError as err:
+        return MediaInfo(sourceFile=source_file, sizeBytes=st.st_size, error=str(err))
+    with __MEDIA_INFO_CACHE_LOCK:
+        __MEDIA_INFO_CACHE[key] = (st.st_size, st.st_mtime_ns, result)
+        __MEDIA_INFO_CACHE.move_to_end(key)
+        while len(__MEDIA_INFO_CACHE) > MEDIA_INFO_CACHE_MAX_SIZE:
+            __MEDIA_INFO_CACHE.popitem(last=False)
+    return result
+
+
+def probe_media_files(
+    source_files: Iterable[str], max_workers: Optional[int] = None
+) -> List[MediaInfo]:
+    """
+    Probes many files on a thread pool (the work is mostly file io
+    and ffprobe subprocesses, so threads overlap well).
+    Results are in the same order as `source_files`.
+    """
+    source_files = list(source_files)
+    if len(source_files) <= 1:
+        return [probe_media(s) for s in source_files]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(probe_media, source_files))
+
+
+@dataclass
+class TranscribeBatchPlan:
+    requests: List[TranscribeJobRequest] = field(default_factory=list)
+    rejected: List[TranscribeJobRequest] = field(default_factory=list)
+    mediaInfoByJobId: Dict[str, MediaInfo] = field(default_factory=dict)
+    concurrency: int = 0
+    expectedMakespanSecs: float = 0.0
+    totalDurationSecs: float = 0.0
+    unknownDurationJobIds: List[str] = field(default_factory=list)
+
+    def get_error(self, job_id: str) -> str:
+        info = self.mediaInfoByJobId.get(job_id)
+        return info.error if info else ""
+
+    def rejected_jobs(self, batch_id: str) -> List[TranscribeJob]:
+        """
+        The rejected requests as FAILED jobs,
+        for a service to merge into its batch result
+        """
+        result = []
+        for r in self.rejected:
+            job = r.to_job(batch_id, status=TranscribeJobStatus.FAILED)
+            job.error = self.get_error(r.jobId)
+            result.append(job)
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": [r.to_dict() for r in self.requests],
+            "rejected": [r.to_dict() for r in self.rejected],
+            "mediaInfoByJobId": {
+                k: v.to_dict() for k, v in self.mediaInfoByJobId.items()
+            },
+            "concurrency": self.concurrency,
+            "expectedMakespanSecs": self.expectedMakespanSecs,
+            "totalDurationSecs": self.totalDurationSecs,
+            "unknownDurationJobIds": list(self.unknownDurationJobIds),
+        }
+
+
+def expected_makespan(durations: Iterable[float], concurrency: int = 0) -> float:
+    """
+    Wall time to finish all durations when they are started longest first
+    on `concurrency` workers (0 means unlimited)
+    """
+    durations = sorted(durations, reverse=True)
+    if not durations:
+        return 0.0
+    if concurrency <= 0 or concurrency >= len(durations):
+        return durations[0]
+    loads = [0.0] * concurrency
+    for d in durations:
+        heapq.heapreplace(loads, loads[0] + d)
+    return max(loads)
+
+
+def plan_transcribe_batch(
+    transcribe_requests: Iterable[TranscribeJobRequest],
+    concurrency: int = 0,
+    supported_media_formats: Iterable[str] = SUPPORTED_MEDIA_FORMATS,
+    max_workers: Optional[int] = None,
+) -> TranscribeBatchPlan:
+    """
+    Probes the source files of a batch before anything is uploaded.
+
+    Returns a plan whose `requests` have media format, duration and size
+    filled in and are ordered longest first, so that one long file
+    doesn't start last and set the wall time of the whole batch.
+    Requests for missing, corrupt or unsupported files are moved
+    to `rejected`. An explicitly set `mediaFormat` is kept as is.
+
+    Files whose duration couldn't be probed (e.g. flac without ffprobe)
+    go first, since they may be the longest, and are listed in
+    `unknownDurationJobIds`; `expectedMakespanSecs` then only covers
+    the known durations and is a lower bound.
+    """
+    requests = list(transcribe_requests)
+    supported = frozenset(supported_media_formats)
+    infos = probe_media_files([r.sourceFile for r in requests], max_workers)
+    plan = TranscribeBatchPlan(concurrency=concurrency)
+    for r, info in zip(requests, infos):
+        media_format = r.mediaFormat or info.mediaFormat
+        if info.is_valid() and media_format not in supported:
+            info = replace(info, error=f"unsupported media format '{media_format}'")
+        plan.mediaInfoByJobId[r.jobId] = info
+        if not info.is_valid():
+            plan.rejected.append(r)
+            continue
+        if info.warning:
+            logging.warning(f"{r.sourceFile}: {info.warning}")
+            plan.unknownDurationJobIds.append(r.jobId)
+        plan.requests.append(
+            replace(
+                r,
+                mediaFormat=media_format,
+                durationSecs=info.durationSecs,
+                sizeBytes=info.sizeBytes,
+            )
+        )
+    unknown = set(plan.unknownDurationJobIds)
+    plan.requests.sort(
+        key=lambda r: (r.jobId in unknown, r.durationSecs, r.sizeBytes), reverse=True
+    )
+    durations = [r.durationSecs for r in plan.requests if r.jobId not in unknown]
+    plan.totalDurationSecs = sum(durations)
+    plan.expectedMakespanSecs = expected_makespan(durations, concurrency)
+    summary = f"planned transcribe batch: {len(plan.requests)} jobs ({len(plan.rejected)} rejected), {plan.totalDurationSecs:.1f}s of media, expected makespan {plan.expectedMakespanSecs:.1f}s"
+    if unknown:
+        logging.warning(
+            f"{summary} (a lower bound: {len(unknown)} jobs have unknown duration: {plan.unknownDurationJobIds})"
+        )
+    else:
+        logging.info(summary)
+    return plan
@@ -18,12 +18,15 @@ except ImportError:
     from yaml import Loader as YamlLoader  # type: ignore
 
 from transcribe import (
+    copy_shallow,
     TranscribeBatchResult,
     TranscribeJob,
     TranscribeJobRequest,
     TranscribeJobStatus,
     TranscribeJobsUpdate,
+    TranscriptSegment,
 )
+from transcribe.tokens import TranscriptTokens
 
 
 def yaml_load(from_path: str) -> Dict[str, Any]:
@@ -45,9 +48,13 @@ class MockTranscribeJob:
     info: Dict[str, str] = field(default_factory=dict)
     status: TranscribeJobStatus = TranscribeJobStatus.SUCCEEDED
     transcript: str = ""
+    segments: List[TranscriptSegment] = field(default_factory=list)
+    partial_segments: List[List[TranscriptSegment]] = field(default_factory=list)
+    tokens: Optional[TranscriptTokens] = None
 
     def add_result(self, result: TranscribeBatchResult) -> TranscribeBatchResult:
         job = self.request.to_job(self.batch_id)
+        job.segments = list(self.segments)
         result.transcribeJobsById[job.get_fq_id()] = job
         result.update_job(
             job.get_fq_id(),
@@ -55,9 +62,31 @@ class MockTranscribeJob:
             info=self.info,
             transcript=self.transcript,
             error=self.error,
+            tokens=self.tokens,
         )
         return result
 
+    def add_updates(
+        self, updates: List[TranscribeJobsUpdate]
+    ) -> List[TranscribeJobsUpdate]:
+        """
+        Adds an IN_PROGRESS update for each entry of `partial_segments`
+        with the segments delta a streaming backend would send for it
+        """
+        result = TranscribeBatchResult()
+        job = self.request.to_job(self.batch_id, status=TranscribeJobStatus.IN_PROGRESS)
+        result.transcribeJobsById[job.get_fq_id()] = job
+        for segments in self.partial_segments:
+            delta = result.append_segments(job.get_fq_id(), segments)
+            updates.append(
+                TranscribeJobsUpdate(
+                    result=copy_shallow(result),
+                    idsUpdated=[job.get_fq_id()],
+                    segmentDeltasById={job.get_fq_id(): delta},
+                )
+            )
+        return updates
+
 
 @dataclass
 class MockTranscribeCallFixture:
@@ -135,10 +164,12 @@ class MockTranscriptions:
 
     def mock_transcribe_result(self, mock_jobs: List[MockTranscribeJob]) -> None:
         result = TranscribeBatchResult()
+        updates: List[TranscribeJobsUpdate] = []
         for j in mock_jobs:
             j.add_result(result)
+            j.add_updates(updates)
         self.mock_transcribe_result_and_callbacks(
-            MockTranscribeCallFixture(result=result)
+            MockTranscribeCallFixture(result=result, updates=updates)
         )
 
     def mock_transcribe_result_and_callbacks(
@@ -0,0 +1,315 @@
+#
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+import cProfile
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import transcribe
+from transcribe import (
+    next_job_id,
+    ProfileTimer,
+    TranscribeBatchResult,
+    TranscribeJobRequest,
+    TranscribeJobsUpdate,
+    TranscriptionService,
+)
+
+PROFILE_ENV = "TRANSCRIBE_PROFILE"
+PROFILE_CAPTURE_ENV = "TRANSCRIBE_PROFILE_CAPTURE"
+PROFILE_CONFIG_KEY = "profile"
+_TRUTHY = ["1", "true", "yes", "on"]
+_FALSY = ["", "0", "false", "no", "off"]
+
+
+@dataclass
+class ProfileConfig:
+    enabled: bool = False
+    reportDir: str = "."
+    cprofile: bool = False
+    tracemalloc: bool = False
+    topN: int = 20
+
+
+def profile_config(config: Dict[str, Any] = {}) -> ProfileConfig:
+    """
+    Reads profiling options from the service config, which may have
+    `"profile": True`, `"profile": "/report/dir"` or
+    `"profile": {"reportDir": ..., "cprofile": True, "tracemalloc": True}`.
+
+    Otherwise falls back to env `TRANSCRIBE_PROFILE` (1/true or a report dir)
+    and `TRANSCRIBE_PROFILE_CAPTURE` (e.g. "cprofile,tracemalloc").
+    """
+    c = config.get(PROFILE_CONFIG_KEY)
+    if isinstance(c, dict):
+        unknown = sorted(set(c.keys()) - set(ProfileConfig.__dataclass_fields__))
+        if unknown:
+            raise ValueError(
+                f"unknown key(s) {unknown} in config '{PROFILE_CONFIG_KEY}' (valid keys={sorted(ProfileConfig.__dataclass_fields__)})"
+            )
+        return ProfileConfig(**{"enabled": True, **c})
+    if isinstance(c, str):
+        return _profile_config_from_str(c)
+    if c is not None:
+        return ProfileConfig(enabled=bool(c))
+    result = _profile_config_from_str(os.environ.get(PROFILE_ENV, ""))
+    if result.enabled:
+        capture = [
+            x.strip().lower()
+            for x in os.environ.get(PROFILE_CAPTURE_ENV, "").split(",")
+        ]
+        result.cprofile = "cprofile" in capture
+        result.tracemalloc = "tracemalloc" in capture
+    return result
+
+
+def _profile_config_from_str(v: str) -> ProfileConfig:
+    if v.strip().lower() in _FALSY:
+        return ProfileConfig()
+    return ProfileConfig(
+        enabled=True, reportDir="." if v.strip().lower() in _TRUTHY else v
+    )
+
+
+@dataclass
+class TimerStats:
+    count: int = 0
+    totalSecs: float = 0.0
+    maxSecs: float = 0.0
+
+    def add(self, secs: float) -> None:
+        self.count += 1
+        self.totalSecs += secs
+        self.maxSecs = max(self.maxSecs, secs)
+
+
+@dataclass
+class ProfileReport:
+    batchId: str
+    wallSecs: float = 0.0
+    timers: Dict[str, TimerStats] = field(default_factory=dict)
+    callbackTimeShare: float = 0.0
+    hotSpots: List[Dict[str, Any]] = field(default_factory=list)
+    allocationPeakBytes: int = 0
+    allocationSites: List[Dict[str, Any]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+# tracemalloc is process-wide, so it's shared by all active profilers
+_TRACEMALLOC_LOCK = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started_here = False
+
+
+def _tracemalloc_acquire() -> None:
+    global _tracemalloc_users, _tracemalloc_started_here
+    with _TRACEMALLOC_LOCK:
+        if _tracemalloc_users == 0:
+            _tracemalloc_started_here = not tracemalloc.is_tracing()
+            if _tracemalloc_started_here:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        _tracemalloc_users += 1
+
+
+def _tracemalloc_release(top_n: int) -> Tuple[int, List[Dict[str, Any]]]:
+    global _tracemalloc_users, _tracemalloc_started_here
+    with _TRACEMALLOC_LOCK:
+        peak = tracemalloc.get_traced_memory()[1]
+        sites = [
+            {"site": str(s.traceback), "sizeBytes": s.size, "count": s.count}
+            for s in tracemalloc.take_snapshot().statistics("lineno")[:top_n]
+        ]
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started_here:
+            tracemalloc.stop()
+            _tracemalloc_started_here = False
+    return peak, sites
+
+
+class TranscribeProfiler(ProfileTimer):
+    """
+    Collects timers for one batch, optionally with cProfile
+    (which only sees the thread that called `transcribe`)
+    and tracemalloc (which sees all threads). Since tracemalloc is
+    process-wide, allocation peaks and sites cover the whole process
+    (including any other batches running at the same time)
+    since the first of the currently profiled batches started.
+    """
+
+    def __init__(self, config: ProfileConfig):
+        self.config = config
+        self.timers: Dict[str, TimerStats] = {}
+        self._lock = threading.Lock()
+        self._cprofile: Optional[cProfile.Profile] = None
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            secs = time.perf_counter() - t
+            with self._lock:
+                self.timers.setdefault(name, TimerStats()).add(secs)
+
+    def start(self) -> None:
+        if self.config.tracemalloc:
+            _tracemalloc_acquire()
+        if self.config.cprofile:
+            self._cprofile = cProfile.Profile()
+            try:
+                self._cprofile.enable()
+            except ValueError:
+                # another profiler is already active
+                self._cprofile = None
+
+    def stop(self, batch_id: str) -> ProfileReport:
+        if self._cprofile:
+            self._cprofile.disable()
+        report = ProfileReport(batchId=batch_id, timers=dict(self.timers))
+        if self.config.tracemalloc:
+            report.allocationPeakBytes, report.allocationSites = _tracemalloc_release(
+                self.config.topN
+            )
+        transcribe_stats = self.timers.get("transcribe")
+        on_update_stats = self.timers.get("on_update")
+        if transcribe_stats:
+            report.wallSecs = transcribe_stats.totalSecs
+        if transcribe_stats and on_update_stats and transcribe_stats.totalSecs:
+            report.callbackTimeShare = (
+                on_update_stats.totalSecs / transcribe_stats.totalSecs
+            )
+        if self._cprofile:
+            report.hotSpots = self._hot_spots(pstats.Stats(self._cprofile))
+        return report
+
+    def _hot_spots(self, stats: pstats.Stats) -> List[Dict[str, Any]]:
+        rows = sorted(
+            stats.stats.items(), key=lambda kv: kv[1][2], reverse=True  # type: ignore
+        )
+        return [
+            {
+                "function": f"{filename}:{line}({func})",
+                "calls": nc,
+                "totalSecs": tt,
+                "cumulativeSecs": ct,
+            }
+            for (filename, line, func), (_, nc, tt, ct, _) in rows[: self.config.topN]
+        ]
+
+    def write_report(self, report: ProfileReport) -> str:
+        os.makedirs(self.config.reportDir, exist_ok=True)
+        path = os.path.join(
+            self.config.reportDir, f"transcribe-profile-{report.batchId}.json"
+        )
+        with open(path, "w") as f:
+            json.dump(report.to_dict(), f, indent=2)
+        if self._cprofile:
+            self._cprofile.dump_stats(os.path.splitext(path)[0] + ".prof")
+        return path
+
+
+def _profiled_on_update(
+    profiler: TranscribeProfiler,
+    on_update: Optional[Callable[[TranscribeJobsUpdate], None]],
+) -> Optional[Callable[[TranscribeJobsUpdate], None]]:
+    if not on_update:
+        return None
+
+    def _on_update(u: TranscribeJobsUpdate) -> None:
+        with profiler.timer("on_update"):
+            on_update(u)
+
+    return _on_update
+
+
+class ProfiledTranscriptionService(TranscriptionService):
+    """
+    Wraps a TranscriptionService to time init_service, transcribe,
+    every TranscribeBatchResult.update_job and every on_update call,
+    and to write a profile report per batch.
+
+    update_job calls are attributed to the batch whose context they
+    run in, so concurrent batches each get their own report.
+    A backend that calls update_job from its own worker threads
+    must run them with `contextvars.copy_context()` to have them timed.
+    """
+
+    def __init__(self, service: TranscriptionService, profile: ProfileConfig):
+        self.service = service
+        self.profile = profile
+        self.init_service_stats = TimerStats()
+        self.last_report: Optional[ProfileReport] = None
+        self.last_report_path = ""
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.service, name)
+
+    def init_service(self, config: Dict[str, Any] = {}, **kwargs) -> None:
+        t = time.perf_counter()
+        try:
+            self.service.init_service(config=config, **kwargs)
+        finally:
+            self.init_service_stats.add(time.perf_counter() - t)
+
+    def transcribe(
+        self,
+        transcribe_requests: Iterable[TranscribeJobRequest],
+        batch_id: str = "",
+        on_update: Optional[Callable[[TranscribeJobsUpdate], None]] = None,
+        **kwargs,
+    ) -> TranscribeBatchResult:
+        profiler = TranscribeProfiler(self.profile)
+        if self.init_service_stats.count:
+            profiler.timers["init_service"] = self.init_service_stats
+        result: Optional[TranscribeBatchResult] = None
+        token = transcribe.set_active_profiler(profiler)
+        profiler.start()
+        try:
+            with profiler.timer("transcribe"):
+                result = self.service.transcribe(
+                    transcribe_requests,
+                    batch_id=batch_id,
+                    on_update=_profiled_on_update(profiler, on_update),
+                    **kwargs,
+                )
+        finally:
+            transcribe.reset_active_profiler(token)
+            self._report(profiler, batch_id, result)
+        assert result is not None
+        return result
+
+    def _report(
+        self,
+        profiler: TranscribeProfiler,
+        batch_id: str,
+        result: Optional[TranscribeBatchResult],
+    ) -> None:
+        """
+        Profiling is diagnostics only, so failing to write a report
+        is logged rather than raised over the batch's own result or error
+        """
+        try:
+            first = result.first() if result else None
+            report = profiler.stop(
+                batch_id or (first.batchId if first else "") or next_job_id()
+            )
+            self.last_report = report
+            self.last_report_path = profiler.write_report(report)
+        except Exception:
+            logging.exception("failed to write transcribe profile report")
@@ -0,0 +1,228 @@
+#
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+import struct
+import sys
+from typing import Any, Dict, Iterable, Iterator, List
+
+_BINARY_MAGIC = b"TTK1"
+_BINARY_HEADER = struct.Struct("<4sII")
+NO_SPEAKER = -1
+
+
+@dataclass
+class TranscriptToken:
+    word: str
+    startSecs: float
+    endSecs: float
+    confidence: float = 1.0
+    speaker: str = ""
+
+
+def _to_le_bytes(a: array) -> bytes:
+    if sys.byteorder == "big":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+def _from_le_bytes(typecode: str, b: bytes) -> array:
+    a = array(typecode)
+    a.frombytes(b)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+
+class TranscriptTokens:
+    """
+    Word-level timings, confidences and speakers for one job,
+    stored as one typed array per column rather than a dict per word.
+    Time-range queries use binary search while tokens are in time order
+    and fall back to a linear scan once they aren't
+    (e.g. overlapping speech from several speakers).
+    """
+
+    def __init__(
+        self,
+        words: Iterable[str] = (),
+        starts: Iterable[float] = (),
+        ends: Iterable[float] = (),
+        confidences: Iterable[float] = (),
+        speakerIndexes: Iterable[int] = (),
+        speakers: Iterable[str] = (),
+    ):
+        self.words: List[str] = list(words)
+        self.starts = array("d", starts)
+        self.ends = array("d", ends)
+        self.confidences = array("d", confidences)
+        self.speakerIndexes = array("h", speakerIndexes)
+        self.speakers: List[str] = list(speakers)
+        n = len(self.words)
+        if not self.confidences and n:
+            self.confidences = array("d", [1.0]) * n
+        if not self.speakerIndexes and n:
+            self.speakerIndexes = array("h", [NO_SPEAKER]) * n
+        if not (
+            len(self.starts)
+            == len(self.ends)
+            == len(self.confidences)
+            == len(self.speakerIndexes)
+            == n
+        ):
+            raise ValueError("all token columns must have the same length")
+        self._speaker_index_by_label = {s: i for i, s in enumerate(self.speakers)}
+        self._time_ordered = all(
+            self.starts[i - 1] <= self.starts[i] and self.ends[i - 1] <= self.ends[i]
+            for i in range(1, n)
+        )
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __getitem__(self, i: int) -> TranscriptToken:
+        return TranscriptToken(
+            word=self.words[i],
+            startSecs=self.starts[i],
+            endSecs=self.ends[i],
+            confidence=self.confidences[i],
+            speaker=self.speaker_at(i),
+        )
+
+    def __iter__(self) -> Iterator[TranscriptToken]:
+        return (self[i] for i in range(len(self)))
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, TranscriptTokens) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"TranscriptTokens({self.to_dict()!r})"
+
+    def speaker_at(self, i: int) -> str:
+        s = self.speakerIndexes[i]
+        return self.speakers[s] if s != NO_SPEAKER else ""
+
+    def append(
+        self,
+        word: str,
+        start: float,
+        end: float,
+        confidence: float = 1.0,
+        speaker: str = "",
+    ) -> None:
+        speaker_index = NO_SPEAKER
+        if speaker:
+            speaker_index = self._speaker_index_by_label.setdefault(
+                speaker, len(self.speakers)
+            )
+            if speaker_index == len(self.speakers):
+                self.speakers.append(speaker)
+        if self.words and (start < self.starts[-1] or end < self.ends[-1]):
+            self._time_ordered = False
+        self.words.append(word)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.confidences.append(confidence)
+        self.speakerIndexes.append(speaker_index)
+
+    def take(self, indexes: Iterable[int]) -> "TranscriptTokens":
+        indexes = list(indexes)
+        return TranscriptTokens(
+            words=[self.words[i] for i in indexes],
+            starts=[self.starts[i] for i in indexes],
+            ends=[self.ends[i] for i in indexes],
+            confidences=[self.confidences[i] for i in indexes],
+            speakerIndexes=[self.speakerIndexes[i] for i in indexes],
+            speakers=self.speakers,
+        )
+
+    def slice_time(self, start: float, end: float) -> "TranscriptTokens":
+        """
+        Tokens that overlap [start, end), found by binary search
+        when tokens are in time order
+        """
+        if not self._time_ordered:
+            return self.take(
+                i
+                for i in range(len(self))
+                if self.ends[i] > start and self.starts[i] < end
+            )
+        lo = bisect_right(self.ends, start)
+        hi = bisect_left(self.starts, end)
+        return self.take(range(lo, max(lo, hi)))
+
+    def low_confidence(self, threshold: float) -> "TranscriptTokens":
+        return self.take(i for i, c in enumerate(self.confidences) if c < threshold)
+
+    def text(self) -> str:
+        return " ".join(self.words)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "words": list(self.words),
+            "starts": self.starts.tolist(),
+            "ends": self.ends.tolist(),
+            "confidences": self.confidences.tolist(),
+            "speakerIndexes": self.speakerIndexes.tolist(),
+            "speakers": list(self.speakers),
+        }
+
+    def to_bytes(self) -> bytes:
+        """
+        Little-endian binary form: header, length-prefixed utf-8
+        speakers and words, then each numeric column as raw bytes
+        """
+        words = [w.encode("utf-8") for w in self.words]
+        speakers = [s.encode("utf-8") for s in self.speakers]
+        return b"".join(
+            [
+                _BINARY_HEADER.pack(_BINARY_MAGIC, len(words), len(speakers)),
+                _to_le_bytes(array("I", [len(s) for s in speakers])),
+                *speakers,
+                _to_le_bytes(array("I", [len(w) for w in words])),
+                *words,
+                _to_le_bytes(self.starts),
+                _to_le_bytes(self.ends),
+                _to_le_bytes(self.confidences),
+                _to_le_bytes(self.speakerIndexes),
+            ]
+        )
+
+    @classmethod
+    def from_bytes(cls, b: bytes) -> "TranscriptTokens":
+        magic, n, n_speakers = _BINARY_HEADER.unpack_from(b)
+        if magic != _BINARY_MAGIC:
+            raise ValueError("not a TranscriptTokens binary")
+        pos = _BINARY_HEADER.size
+
+        def _column(typecode: str, count: int) -> array:
+            nonlocal pos
+            size = array(typecode).itemsize * count
+            result = _from_le_bytes(typecode, b[pos : pos + size])
+            pos += size
+            return result
+
+        def _strings(count: int) -> List[str]:
+            nonlocal pos
+            result = []
+            for length in _column("I", count):
+                result.append(b[pos : pos + length].decode("utf-8"))
+                pos += length
+            return result
+
+        speakers = _strings(n_speakers)
+        words = _strings(n)
+        return cls(
+            words=words,
+            starts=_column("d", n),
+            ends=_column("d", n),
+            confidences=_column("d", n),
+            speakerIndexes=_column("h", n),
+            speakers=speakers,
+        )